@@ -1,15 +1,34 @@
 import os
 import io
-from typing import Optional
+import json
+import asyncio
+import hmac
+import hashlib
+import sqlite3
+import functools
+import threading
+from contextlib import closing
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, Optional
+import httpx
 import streamlit as st
 import pdfplumber
+import pypdfium2 as pdfium
 import docx
-from openai import OpenAI
+import faiss
+import tiktoken
+from sentence_transformers import SentenceTransformer
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 
 # --------- CONFIG & SECRETS ---------
 
 # Read secrets (works locally via .streamlit/secrets.toml and on Streamlit Cloud)
-PASSCODE = st.secrets.get("APP_PASSCODE")
+_passcode = st.secrets.get("APP_PASSCODE")
+# Only a digest is kept at module level; compared in constant time in check_password().
+PASSCODE_HASH = (
+    hashlib.sha256(_passcode.encode()).digest() if _passcode is not None else None
+)
+del _passcode
 OPENAI_API_KEY = st.secrets.get("OPENAI_API_KEY") or os.getenv("OPENAI_API_KEY")
 
 if not OPENAI_API_KEY:
@@ -19,7 +38,32 @@ if not OPENAI_API_KEY:
     )
     st.stop()
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+
+@st.cache_resource(show_spinner=False)
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """One long-lived event loop on a daemon thread, shared by all sessions and reruns."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+
+@st.cache_resource(show_spinner=False)
+def get_client() -> AsyncOpenAI:
+    # Cached process-wide so the HTTP/2 keep-alive pool survives reruns. All calls run
+    # on get_event_loop(), so the pool is never tied to a closed loop.
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=DefaultAsyncHttpxClient(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20),
+        ),
+    )
+
+
+# The initial rewrite needs the stronger model; follow-up questions about an
+# already-simplified summary are routed to a cheaper, faster one.
+SUMMARY_MODEL = "gpt-4.1-mini"
+CHAT_MODEL = "gpt-4.1-nano"
 
 
 # --------- AUTH / PASSCODE GATE ---------
@@ -27,7 +71,7 @@ client = OpenAI(api_key=OPENAI_API_KEY)
 def check_password() -> bool:
     """Simple passcode gate using Streamlit session_state + secrets."""
 
-    if PASSCODE is None:
+    if PASSCODE_HASH is None:
         st.warning(
             "APP_PASSCODE is not set in secrets. "
             "Anyone with the URL can access this app."
@@ -39,13 +83,16 @@ def check_password() -> bool:
         st.session_state["authenticated"] = False
 
     def _submit():
-        if PASSCODE is None:
+        if PASSCODE_HASH is None:
             # No passcode configured → treat as always authenticated
             st.session_state["authenticated"] = True
             st.session_state["login_error"] = ""
             return
 
-        if st.session_state.get("passcode_input", "") == PASSCODE:
+        entered = hashlib.sha256(
+            st.session_state.get("passcode_input", "").encode()
+        ).digest()
+        if hmac.compare_digest(entered, PASSCODE_HASH):
             st.session_state["authenticated"] = True
             st.session_state["login_error"] = ""
         else:
@@ -77,81 +124,375 @@ if not check_password():
 
 # --------- HELPERS: FILE PARSING & LLM CALL ---------
 
+def _extract_pdf_pages(file_bytes: bytes, pages: range) -> list[str]:
+    # pdfplumber objects aren't thread-safe, so each worker opens its own copy.
+    with pdfplumber.open(io.BytesIO(file_bytes), pages=[i + 1 for i in pages]) as pdf:
+        return [page.extract_text() or "" for page in pdf.pages]
+
+
+def _extract_pdf_pdfplumber(file_bytes: bytes) -> str:
+    """Extract PDF text with pages split into contiguous ranges across a thread pool."""
+    with pdfplumber.open(io.BytesIO(file_bytes)) as pdf:
+        n_pages = len(pdf.pages)
+    if n_pages == 0:
+        return ""
+
+    workers = min(os.cpu_count() or 1, n_pages)
+    step = -(-n_pages // workers)  # ceil division
+    ranges = [range(i, min(i + step, n_pages)) for i in range(0, n_pages, step)]
+    with ThreadPoolExecutor(max_workers=len(ranges)) as pool:
+        chunks = pool.map(lambda pages: _extract_pdf_pages(file_bytes, pages), ranges)
+    text_pages = [text for chunk in chunks for text in chunk]
+    return "\n\n".join(text_pages).strip()
+
+
+@st.cache_resource(show_spinner=False)
+def _pdfium_lock() -> threading.Lock:
+    # PDFium isn't thread-safe, even across documents, and each session's script runs on
+    # its own thread. This script is re-executed on every rerun, so a plain module-level
+    # Lock would be a new object each time; cache_resource makes it one per process.
+    return threading.Lock()
+
+
+def _extract_pdf(file_bytes: bytes) -> str:
+    """Extract PDF text with PDFium, falling back to pdfplumber if it finds nothing."""
+    # Every PDFium object is created and closed under the lock, so no finalizer can
+    # touch the library from another thread later.
+    with _pdfium_lock():
+        pdf = pdfium.PdfDocument(file_bytes)
+        try:
+            page_texts = []
+            for page in pdf:
+                textpage = page.get_textpage()
+                page_texts.append(textpage.get_text_range())
+                textpage.close()
+                page.close()
+        finally:
+            pdf.close()
+    text = "\n\n".join(page_texts).strip()
+    return text or _extract_pdf_pdfplumber(file_bytes)
+
+
+def _extract_docx(file_bytes: bytes) -> str:
+    doc = docx.Document(io.BytesIO(file_bytes))
+    return "\n".join(p.text for p in doc.paragraphs).strip()
+
+
+def _extract_text(file_bytes: bytes) -> str:
+    return file_bytes.decode("utf-8").strip()
+
+
+# MIME type -> extractor. Any other text/* type is read as plain text.
+_HANDLERS = {
+    "application/pdf": _extract_pdf,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": _extract_docx,
+    "application/msword": _extract_docx,
+}
+_TEXT_PREFIX = "text/"
+
+
+@st.cache_data(show_spinner=False)
+def _extract_cached(file_bytes: bytes, mime: str) -> Optional[str]:
+    """Parse uploaded bytes; cached so reruns don't re-parse the same file."""
+    handler = _HANDLERS.get(mime) or (
+        _extract_text if mime.startswith(_TEXT_PREFIX) else None
+    )
+    return handler(file_bytes) if handler else None
+
+
 def extract_text_from_file(uploaded_file) -> Optional[str]:
     """Extract plain text from PDF, DOCX, or TXT uploads."""
     if uploaded_file is None:
         return None
 
-    mime = uploaded_file.type
+    # Read the upload into bytes once per file and reuse them on later reruns; parsers
+    # get their own io.BytesIO view, and the bytes double as the extraction cache key.
+    cached = st.session_state.get("upload_bytes")
+    if cached is None or cached[0] != uploaded_file.file_id:
+        cached = (uploaded_file.file_id, uploaded_file.getvalue())
+        st.session_state["upload_bytes"] = cached
+    data = cached[1]
 
     try:
-        # PDF
-        if mime == "application/pdf":
-            text_pages = []
-            with pdfplumber.open(uploaded_file) as pdf:
-                for page in pdf.pages:
-                    page_text = page.extract_text() or ""
-                    text_pages.append(page_text)
-            return "\n\n".join(text_pages).strip()
-
-        # DOCX
-        elif mime in [
-            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            "application/msword",
-        ]:
-            # python-docx can read file-like objects directly
-            doc = docx.Document(uploaded_file)
-            return "\n".join(p.text for p in doc.paragraphs).strip()
-
-        # Plain text
-        elif mime.startswith("text/"):
-            return uploaded_file.read().decode("utf-8").strip()
-
-        else:
-            return None
-
+        return _extract_cached(data, uploaded_file.type)
     except Exception as e:
         st.error(f"Error reading file: {e}")
         return None
 
 
+# (heading, hint) for each summary section, in output order.
+SUMMARY_SECTIONS = [
+    ("Why you were in the hospital", ""),
+    ("What we did for you", ""),
+    ("Your main health problems", "everyday words"),
+    ("Your medicines", "changed / same"),
+    ("What to do at home", "diet, activity, monitoring"),
+    ("Warning signs – call your clinic", ""),
+    ("Emergency signs – call 911", ""),
+    ("Your follow-up visits", "who, when, why"),
+]
+
+# Each section is requested separately (see generate_summary), so the shared prefix
+# only names them briefly; the full heading and hint go in the per-section request.
 SYSTEM_PROMPT = """
-You are a nurse explaining hospital discharge instructions to a patient and their family.
-
-Take the discharge summary below and create a clear, friendly summary for the patient.
-
-Requirements:
-- Reading level: around 6th–8th grade.
-- Use short sentences and bullet points.
-- Avoid medical jargon when possible. If you must use a medical term, explain it in plain language.
-- Never change medical facts, medicine names, doses, or dates.
-- Preserve all safety-critical information: red-flag symptoms, when to call the clinic,
-  when to go to the ER, and follow-up appointments.
-- If something important is missing or unclear in the original text, say:
-  "This was not clearly explained in your record."
-
-Output structure:
-1. Why you were in the hospital
-2. What we did for you
-3. Your main health problems (in everyday words)
-4. Your medicines (what changed, what stayed the same)
-5. What you should do at home (diet, activity, monitoring)
-6. Warning signs – call your clinic
-7. Emergency signs – call 911
-8. Your follow-up visits (who, when, and why)
+Role: friendly nurse. Audience: patient and family, grade 6-8. Short sentences, bullets; explain any jargon.
+Never alter facts, medicines, doses, or dates. Keep all red flags, clinic/ER triggers, and follow-ups.
+If missing or unclear: "This was not clearly explained in your record."
+Guide sections: why admitted, what we did, problems, medicines, home care, clinic warning signs, 911 signs, follow-ups. Write only the one requested.
 """
 
 
-def generate_summary(discharge_text: str) -> str:
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",  # change if you prefer another model
-        messages=[
-            {"role": "system", "content": SYSTEM_PROMPT},
-            {"role": "user", "content": f"Discharge summary:\n{discharge_text}"},
-        ],
-        temperature=0.3,
+def submit_async(coro) -> Future:
+    """Schedule a coroutine on the shared event loop without waiting for it."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_async(coro):
+    """Run a coroutine on the shared event loop and wait for its result."""
+    return submit_async(coro).result()
+
+
+def stream_async(agen: AsyncIterator[str]) -> Iterator[str]:
+    """Drive an async token generator from the (sync) Streamlit script, e.g. for st.write_stream."""
+    try:
+        while True:
+            try:
+                yield run_async(agen.__anext__())
+            except StopAsyncIteration:
+                break
+    finally:
+        run_async(agen.aclose())
+
+
+# Exact-match response cache. Only deterministic (temperature 0) requests are cached.
+CACHE_DB_PATH = ".summary_cache.db"
+
+
+def _cache_connect() -> sqlite3.Connection:
+    conn = sqlite3.connect(CACHE_DB_PATH)
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, response TEXT NOT NULL)"
+    )
+    return conn
+
+
+# Blocking SQLite I/O; called via asyncio.to_thread so it never stalls the shared loop.
+def _cache_get(key: str) -> Optional[str]:
+    with closing(_cache_connect()) as conn:
+        row = conn.execute("SELECT response FROM cache WHERE key=?", (key,)).fetchone()
+    return row[0] if row is not None else None
+
+
+def _cache_put(key: str, response: str) -> None:
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (key, response) VALUES (?, ?)",
+            (key, response),
+        )
+
+
+def _cache_delete(key: str) -> None:
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute("DELETE FROM cache WHERE key=?", (key,))
+
+
+def cache_key(model: str, messages: list[dict], temperature: float) -> str:
+    return hashlib.sha256(
+        json.dumps(
+            {"model": model, "t": temperature, "msgs": messages}, sort_keys=True
+        ).encode()
+    ).hexdigest()
+
+
+def cached_call(fn):
+    """Serve repeated (model, temperature, messages) requests from the SQLite cache."""
+
+    @functools.wraps(fn)
+    async def wrapper(
+        model: str, messages: list[dict], temperature: float
+    ) -> AsyncIterator[str]:
+        if temperature != 0.0:
+            async for delta in fn(model, messages, temperature):
+                yield delta
+            return
+
+        key = cache_key(model, messages, temperature)
+
+        cached = await asyncio.to_thread(_cache_get, key)
+        if cached is not None:
+            yield cached
+            return
+
+        parts = []
+        async for delta in fn(model, messages, temperature):
+            parts.append(delta)
+            yield delta
+
+        # Only reached when the stream completed, so partial replies are never stored.
+        await asyncio.to_thread(_cache_put, key, "".join(parts))
+
+    return wrapper
+
+
+@cached_call
+async def stream_completion(
+    model: str, messages: list[dict], temperature: float
+) -> AsyncIterator[str]:
+    stream = await get_client().chat.completions.create(
+        model=model,
+        messages=messages,
+        temperature=temperature,
+        stream=True,
     )
-    return resp.choices[0].message.content
+    async for chunk in stream:
+        if chunk.choices:
+            yield chunk.choices[0].delta.content or ""
+
+
+@st.cache_resource(show_spinner=False)
+def get_encoding() -> tiktoken.Encoding:
+    try:
+        return tiktoken.encoding_for_model(CHAT_MODEL)
+    except KeyError:
+        # Older tiktoken releases don't know the 4.1 family; it uses o200k_base.
+        return tiktoken.get_encoding("o200k_base")
+
+
+def canonicalize_text(text: str) -> str:
+    """Normalize newlines and trailing whitespace so the same document is byte-identical."""
+    lines = text.replace("\r\n", "\n").replace("\r", "\n").split("\n")
+    return "\n".join(line.rstrip() for line in lines).strip()
+
+
+def build_context_message(discharge_text: str) -> dict:
+    """Build the discharge-summary message once per document.
+
+    It must stay byte-identical across calls and always sit right after the system
+    prompt, so OpenAI's automatic prompt caching can reuse the prefix on every turn.
+    """
+    return {"role": "user", "content": f"Discharge summary:\n{discharge_text}"}
+
+
+async def _collect(agen: AsyncIterator[str]) -> str:
+    return "".join([delta async for delta in agen])
+
+
+# Documents longer than this are condensed (map-reduce) before summarizing.
+MAX_INPUT_TOKENS = 24000
+CONDENSE_CHUNK_TOKENS = 6000
+CONDENSE_MAX_PASSES = 2  # map rounds before falling back to head+tail truncation
+
+CONDENSE_PROMPT = """
+Condense this part of a hospital discharge summary for later rewriting.
+- Keep every medical fact, medicine name, dose, date, red-flag symptom, and follow-up exactly.
+- Drop only repetition and boilerplate.
+"""
+
+
+def count_tokens(text: str) -> int:
+    # encode_ordinary: document text like "<|endoftext|>" is plain text, not an error.
+    return len(get_encoding().encode_ordinary(text))
+
+
+async def condense_discharge_text(
+    text: str, enc: tiktoken.Encoding, model: str = SUMMARY_MODEL
+) -> tuple[str, bool]:
+    """Shrink text to MAX_INPUT_TOKENS by condensing fixed-size chunks in parallel.
+
+    Returns (text, truncated). `truncated` is True when condensing wasn't enough and the
+    middle of the document was cut out, so content may be missing. `enc` is passed in from the script thread; tokenizing runs via asyncio.to_thread so
+    it doesn't block the shared event loop.
+    """
+    tokens = await asyncio.to_thread(enc.encode_ordinary, text)
+    for _ in range(CONDENSE_MAX_PASSES):
+        if len(tokens) <= MAX_INPUT_TOKENS:
+            return text, False
+
+        chunks = [
+            enc.decode(tokens[i : i + CONDENSE_CHUNK_TOKENS])
+            for i in range(0, len(tokens), CONDENSE_CHUNK_TOKENS)
+        ]
+        parts = await asyncio.gather(
+            *(
+                _collect(
+                    stream_completion(
+                        model,
+                        [
+                            {"role": "system", "content": CONDENSE_PROMPT},
+                            {"role": "user", "content": chunk},
+                        ],
+                        0.0,
+                    )
+                )
+                for chunk in chunks
+            )
+        )
+        condensed = "\n\n".join(part.strip() for part in parts)
+        condensed_tokens = await asyncio.to_thread(enc.encode_ordinary, condensed)
+        if len(condensed_tokens) >= len(tokens):
+            break
+        # Reduce step: the next pass works on the condensed text.
+        text, tokens = condensed, condensed_tokens
+
+    if len(tokens) <= MAX_INPUT_TOKENS:
+        return text, False
+    # Still too long; hard-truncate, keeping the head and tail.
+    half = MAX_INPUT_TOKENS // 2
+    truncated = enc.decode(tokens[:half]) + "\n\n[…]\n\n" + enc.decode(tokens[-half:])
+    return truncated, True
+
+
+async def generate_summary(
+    context_message: dict, model: str = SUMMARY_MODEL
+) -> AsyncIterator[str]:
+    """Stream section 1 live; generate the other sections concurrently behind it.
+
+    Sections 2-8 are only started once section 1 returns its first chunk. By then OpenAI
+    has prefilled the shared [system, context] prefix, so they can be served from its
+    prompt cache instead of all sending the full document cold at the same moment.
+    """
+    base = [{"role": "system", "content": SYSTEM_PROMPT}, context_message]
+
+    def section(i: int, title: str, hint: str) -> AsyncIterator[str]:
+        # temperature=0 keeps each section deterministic, so repeats are cache hits.
+        return stream_completion(
+            model,
+            [
+                *base,
+                {
+                    "role": "user",
+                    "content": f"Write ONLY section {i}: {title}"
+                    f"{f' ({hint})' if hint else ''}. "
+                    "Do not repeat the section heading.",
+                },
+            ],
+            0.0,
+        )
+
+    (first_title, first_hint), *rest = SUMMARY_SECTIONS
+    tasks = []
+
+    def start_rest():
+        tasks.extend(
+            asyncio.create_task(_collect(section(i, title, hint)))
+            for i, (title, hint) in enumerate(rest, 2)
+        )
+
+    try:
+        yield f"### 1. {first_title}\n\n"
+        async for delta in section(1, first_title, first_hint):
+            if not tasks:
+                start_rest()
+            yield delta
+        if not tasks:
+            start_rest()
+
+        for i, ((title, _), task) in enumerate(zip(rest, tasks), 2):
+            yield f"\n\n### {i}. {title}\n\n"
+            yield (await task).strip()
+    finally:
+        for task in tasks:
+            task.cancel()
 
 
 # Chat prompt focuses on answering questions about the provided discharge text.
@@ -167,21 +508,156 @@ Rules:
 """
 
 
-def generate_chat_response(discharge_text: str, messages: list[dict]) -> str:
-    context_message = {
-        "role": "user",
-        "content": f"Discharge summary:\n{discharge_text}",
-    }
-    resp = client.chat.completions.create(
-        model="gpt-4.1-mini",
-        messages=[
-            {"role": "system", "content": CHAT_SYSTEM_PROMPT},
-            context_message,
-            *messages,
-        ],
-        temperature=0.2,
-    )
-    return resp.choices[0].message.content
+FAQ_PROMPT = """
+List the 5 questions this patient or family is most likely to ask about the discharge
+summary, each answered following the rules above. Reply with JSON only:
+{"faq": [{"question": "...", "answer": "..."}]}
+"""
+
+
+async def generate_faq(
+    context_message: dict, model: str = CHAT_MODEL
+) -> list[dict]:
+    """Anticipate likely chat questions alongside the summary.
+
+    Sends the same [CHAT_SYSTEM_PROMPT, context] prefix on the same model as chat turns:
+    the answers are later served as chat replies, and the request warms the prompt cache
+    for the first real question.
+    """
+    messages = [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        context_message,
+        {"role": "user", "content": FAQ_PROMPT},
+    ]
+    reply = await _collect(stream_completion(model, messages, 0.0))
+    # Tolerate a ```json fence around the object.
+    reply = reply.strip().removeprefix("```json").strip("`").strip()
+    try:
+        items = json.loads(reply).get("faq")
+    except (ValueError, AttributeError):
+        items = None
+    if not isinstance(items, list):
+        items = []
+    faq = [
+        item
+        for item in items
+        if isinstance(item, dict)
+        and isinstance(item.get("question"), str)
+        and isinstance(item.get("answer"), str)
+    ]
+    if not faq:
+        # Unparseable or empty: don't let this reply be served from the SQLite cache.
+        await asyncio.to_thread(_cache_delete, cache_key(model, messages, 0.0))
+    return faq
+
+
+# Semantic cache: paraphrased questions about the same document reuse earlier answers.
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+SEMANTIC_CACHE_THRESHOLD = 0.92  # cosine similarity
+
+
+@st.cache_resource(show_spinner=False)
+def get_embedder() -> SentenceTransformer:
+    return SentenceTransformer(EMBEDDING_MODEL)
+
+
+def embed_texts(texts: list[str]):
+    # Normalized embeddings make inner product equal to cosine similarity.
+    return get_embedder().encode(texts, normalize_embeddings=True).astype("float32")
+
+
+def get_semantic_cache(context_message: dict) -> dict:
+    """Return the question/answer index for this discharge document (per session)."""
+    if "semantic_cache" not in st.session_state:
+        st.session_state["semantic_cache"] = {}
+
+    doc_key = hashlib.sha256(context_message["content"].encode()).hexdigest()
+    caches = st.session_state["semantic_cache"]
+    if doc_key not in caches:
+        dim = get_embedder().get_sentence_embedding_dimension()
+        caches[doc_key] = {"index": faiss.IndexFlatIP(dim), "answers": []}
+    return caches[doc_key]
+
+
+def seed_semantic_cache(semantic_cache: dict, faq: list[dict]) -> None:
+    """Pre-load anticipated Q/A pairs so matching first questions skip the model."""
+    if not faq:
+        return
+    semantic_cache["index"].add(embed_texts([item["question"] for item in faq]))
+    semantic_cache["answers"].extend(item["answer"] for item in faq)
+
+
+def semantic_cache_text(messages: list[dict]) -> str:
+    """Text embedded for the semantic cache: the current question plus the previous one.
+
+    Follow-ups like "Why?" only mean something next to the question they follow, so they
+    must not match an identical follow-up asked about something else.
+    """
+    questions = [m["content"] for m in messages if m["role"] == "user"]
+    return "\n".join(questions[-2:])
+
+
+# Sliding window over chat history, on top of the always-sent system + context prefix.
+CHAT_HISTORY_MAX_MESSAGES = 16  # last 8 user/assistant pairs
+CHAT_HISTORY_MAX_TOKENS = 6000
+
+
+def trim_history(messages: list[dict]) -> list[dict]:
+    """Keep the most recent messages that fit the window and token budget."""
+    enc = get_encoding()
+    trimmed = []
+    used = 0
+    for message in reversed(messages[-CHAT_HISTORY_MAX_MESSAGES:]):
+        used += len(enc.encode_ordinary(message["content"]))
+        # The latest message (the question being asked) is always kept.
+        if used > CHAT_HISTORY_MAX_TOKENS and trimmed:
+            break
+        trimmed.append(message)
+    return trimmed[::-1]
+
+
+async def generate_chat_response(
+    context_message: dict,
+    history: list[dict],
+    semantic_cache: dict,
+    query,
+    model: str = CHAT_MODEL,
+) -> AsyncIterator[str]:
+    """Answer the latest question in `history`.
+
+    `history` (already trimmed) and `query` (its semantic-cache embedding) are computed
+    in the script thread: this runs on the shared event loop, which must not block.
+    """
+    index = semantic_cache["index"]
+    if index.ntotal:
+        scores, ids = index.search(query, 1)
+        if scores[0][0] >= SEMANTIC_CACHE_THRESHOLD:
+            yield semantic_cache["answers"][ids[0][0]]
+            return
+
+    # Order matters for prompt caching: [system, context, *history]. Nothing dynamic
+    # may be placed ahead of the context message.
+    request = [
+        {"role": "system", "content": CHAT_SYSTEM_PROMPT},
+        context_message,
+        *history,
+    ]
+    parts = []
+    async for delta in stream_completion(model, request, 0.2):
+        parts.append(delta)
+        yield delta
+
+    # Quality fallback: if the cheap model came back empty, retry on the summary model.
+    if not "".join(parts).strip() and model != SUMMARY_MODEL:
+        parts = []
+        async for delta in stream_completion(SUMMARY_MODEL, request, 0.2):
+            parts.append(delta)
+            yield delta
+
+    reply = "".join(parts)
+    if reply.strip():
+        index.add(query)
+        semantic_cache["answers"].append(reply)
 
 
 # --------- MAIN UI ---------
@@ -192,18 +668,46 @@ if "summary_text" not in st.session_state:
     st.session_state["summary_text"] = ""
 if "summary_source" not in st.session_state:
     st.session_state["summary_source"] = ""
+if "context_message" not in st.session_state:
+    st.session_state["context_message"] = None
+if "source_shortened" not in st.session_state:
+    st.session_state["source_shortened"] = ""  # "", "condensed" or "truncated"
+if "faq" not in st.session_state:
+    st.session_state["faq"] = []
+if "faq_future" not in st.session_state:
+    st.session_state["faq_future"] = None
 if "chat_messages" not in st.session_state:
     st.session_state["chat_messages"] = []
 
+
+# Button callbacks run before the rerun that the click triggers, so the new state is
+# already in place for the whole next run and no explicit st.rerun() is needed.
+def _reset_summary():
+    st.session_state["summary_text"] = ""
+    st.session_state["summary_source"] = ""
+    st.session_state["context_message"] = None
+    st.session_state["source_shortened"] = ""
+    st.session_state["faq"] = []
+    if st.session_state["faq_future"] is not None:
+        st.session_state["faq_future"].cancel()
+    st.session_state["faq_future"] = None
+    st.session_state["chat_messages"] = []
+
+
+def _log_out():
+    st.session_state["authenticated"] = False
+
+
+def _clear_chat():
+    st.session_state["chat_messages"] = []
+
+
 header_left, header_right = st.columns([0.8, 0.2])
 with header_left:
     st.title("Patient-Friendly Discharge Summary")
 with header_right:
     if st.session_state["summary_text"]:
-        if st.button("Start new summary", type="primary"):
-            st.session_state["summary_text"] = ""
-            st.session_state["summary_source"] = ""
-            st.session_state["chat_messages"] = []
+        st.button("Start new summary", type="primary", on_click=_reset_summary)
 st.caption(
     "Demo app: upload a discharge summary or paste the text, and get a simpler explanation "
     "for patients and families. Do not use with real patient data."
@@ -212,15 +716,10 @@ st.caption(
 
 with st.sidebar:
     st.header("Session")
-    if st.button("Log out"):
-        st.session_state["authenticated"] = False
-        st.experimental_rerun()
+    st.button("Log out", on_click=_log_out)
 
     if st.session_state["summary_text"]:
-        if st.button("Start a new summary"):
-            st.session_state["summary_text"] = ""
-            st.session_state["summary_source"] = ""
-            st.session_state["chat_messages"] = []
+        st.button("Start a new summary", on_click=_reset_summary)
 
 # Main layout: input first, then summary + chat take the full page
 discharge_text = ""
@@ -264,39 +763,73 @@ if not st.session_state["summary_text"]:
         if not discharge_text.strip():
             st.error("Please provide some discharge text first.")
         else:
-            with st.spinner("Generating summary…"):
+            source = canonicalize_text(discharge_text)
+            shortened = ""
+            if count_tokens(source) > MAX_INPUT_TOKENS:
                 try:
-                    summary = generate_summary(discharge_text.strip())
-                    st.session_state["summary_text"] = summary
-                    st.session_state["summary_source"] = discharge_text.strip()
-                    st.session_state["chat_messages"] = []
-                    st.success("Summary generated. Ask questions below.")
+                    with st.spinner("Condensing a long document…"):
+                        source, truncated = run_async(
+                            condense_discharge_text(source, get_encoding())
+                        )
+                    shortened = "truncated" if truncated else "condensed"
                 except Exception as e:
+                    source = ""
                     st.error(f"Error while calling the language model: {e}")
 
-if st.session_state["summary_text"]:
+            if shortened == "truncated":
+                st.warning(
+                    "This document was too long and had to be shortened. Even after "
+                    "condensing, part of the middle had to be cut out, so some "
+                    "information (for example medicines or follow-up visits) may be "
+                    "missing from the summary. Check it against the original."
+                )
+            elif shortened == "condensed":
+                st.warning(
+                    "This document was too long, so it was condensed before "
+                    "summarizing. Check the summary against the original."
+                )
+
+            # The summary itself is streamed in below, in the summary section.
+            if source:
+                st.session_state["summary_source"] = source
+                st.session_state["source_shortened"] = shortened
+                st.session_state["context_message"] = build_context_message(source)
+                st.session_state["chat_messages"] = []
+
+if st.session_state["summary_source"]:
     st.subheader("Patient-Friendly Summary")
-    st.markdown(st.session_state["summary_text"])
+    if st.session_state["summary_text"]:
+        st.markdown(st.session_state["summary_text"])
+    else:
+        context_message = st.session_state["context_message"]
+        # The FAQ request runs alongside the summary on the chat prefix and model. It
+        # is never waited on here; the first chat turn after it finishes picks it up.
+        st.session_state["faq_future"] = submit_async(
+            generate_faq(context_message, model=CHAT_MODEL)
+        )
+        try:
+            st.session_state["summary_text"] = st.write_stream(
+                stream_async(generate_summary(context_message))
+            )
+            st.success("Summary generated. Ask questions below.")
+        except Exception as e:
+            st.session_state["faq_future"].cancel()
+            st.session_state["faq_future"] = None
+            st.session_state["summary_source"] = ""
+            st.error(f"Error while calling the language model: {e}")
 
+if st.session_state["summary_text"]:
     st.divider()
     st.subheader("Chat About This Discharge Summary")
+    if st.session_state["source_shortened"] == "truncated":
+        st.caption(
+            "Answers come from a shortened version of your document. Part of it was "
+            "cut out, so some information may be missing."
+        )
+    elif st.session_state["source_shortened"] == "condensed":
+        st.caption("Answers come from a condensed version of your document.")
 
-    st.markdown(
-        """
-        <style>
-        .chat-fade-in { animation: fadeInUp 0.5s ease-out; }
-        @keyframes fadeInUp {
-            from { opacity: 0; transform: translateY(8px); }
-            to { opacity: 1; transform: translateY(0); }
-        }
-        </style>
-        <div class="chat-fade-in">
-        """,
-        unsafe_allow_html=True,
-    )
-
-    if st.button("Clear chat"):
-        st.session_state["chat_messages"] = []
+    st.button("Clear chat", on_click=_clear_chat)
 
     for message in st.session_state["chat_messages"]:
         with st.chat_message(message["role"]):
@@ -311,17 +844,33 @@ if st.session_state["summary_text"]:
             st.markdown(user_prompt)
 
         with st.chat_message("assistant"):
-            with st.spinner("Thinking…"):
+            faq_future = st.session_state["faq_future"]
+            if faq_future is not None and faq_future.done():
+                st.session_state["faq_future"] = None
                 try:
-                    reply = generate_chat_response(
-                        st.session_state["summary_source"],
-                        st.session_state["chat_messages"],
-                    )
-                    st.markdown(reply)
-                    st.session_state["chat_messages"].append(
-                        {"role": "assistant", "content": reply}
-                    )
-                except Exception as e:
-                    st.error(f"Error while calling the language model: {e}")
+                    st.session_state["faq"] = faq_future.result()
+                except Exception:
+                    # Best effort: chat simply falls back to the model.
+                    st.session_state["faq"] = []
+                seed_semantic_cache(
+                    get_semantic_cache(st.session_state["context_message"]),
+                    st.session_state["faq"],
+                )
 
-    st.markdown("</div>", unsafe_allow_html=True)
+            try:
+                messages = st.session_state["chat_messages"]
+                reply = st.write_stream(
+                    stream_async(
+                        generate_chat_response(
+                            st.session_state["context_message"],
+                            trim_history(messages),
+                            get_semantic_cache(st.session_state["context_message"]),
+                            embed_texts([semantic_cache_text(messages)]),
+                        )
+                    )
+                )
+                st.session_state["chat_messages"].append(
+                    {"role": "assistant", "content": reply}
+                )
+            except Exception as e:
+                st.error(f"Error while calling the language model: {e}")